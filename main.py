@@ -1,19 +1,65 @@
-import json
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import socket
+import threading
 import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from email.utils import parsedate_to_datetime
+from typing import Callable, List, Dict, Optional, Pattern, Tuple
+from urllib.parse import urlparse
 import random
 
+import numpy as np
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+try:
+    import httpx  # opcional: só é necessário com "http_client": "httpx"
+except ImportError:
+    httpx = None
+
+
+# Padrões compilados uma única vez, no carregamento do módulo
+_PRICE_RE = re.compile(
+    r'<span[^>]*class="[^"]*a-offscreen[^"]*"[^>]*>\s*(R\$[^<]+?)\s*</span>',
+    re.IGNORECASE,
+)
+_NON_NUMERIC_RE = re.compile(r"[^\d,.]")
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Primeiro span de cada tipo de preço, tudo numa única consulta (união XPath)
+_PRICE_XPATH = etree.XPath(
+    f"(//span[{_has_class('a-offscreen')}])[1]"
+    f" | (//span[{_has_class('a-price-whole')}])[1]"
+    f" | (//span[{_has_class('a-price-fraction')}])[1]"
+)
+
+# Remove o separador de milhar (.) e troca a vírgula decimal por ponto numa passada só
+_BRL_TO_FLOAT_TABLE = str.maketrans({".": "", ",": "."})
 
 
 # ==========================
 # Entidades de domínio
 # ==========================
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Product:
     name: str
     url: str
@@ -39,7 +85,11 @@ class ConfigRepository(ABC):
         pass
 
     @abstractmethod
-    def get_interval_between_products(self) -> int:
+    def get_max_concurrent_fetches(self) -> int:
+        pass
+
+    @abstractmethod
+    def get_max_requests_per_host(self) -> int:
         pass
 
     @abstractmethod
@@ -50,10 +100,37 @@ class ConfigRepository(ABC):
     def get_max_retries_per_product(self) -> int:
         pass
 
+    @abstractmethod
+    def get_http_client(self) -> str:
+        pass
+
     @abstractmethod
     def get_retry_delay_seconds(self) -> int:
         pass
 
+    @abstractmethod
+    def get_max_retry_delay_seconds(self) -> int:
+        pass
+
+    @abstractmethod
+    def get_state_path(self) -> str:
+        pass
+
+    @abstractmethod
+    def get_parse_processes_threshold(self) -> int:
+        pass
+
+
+class NotificationStateRepository(ABC):
+
+    @abstractmethod
+    def load_last_notified(self) -> Dict[str, float]:
+        pass
+
+    @abstractmethod
+    def save_last_notified(self, last_notified: Dict[str, float]) -> None:
+        pass
+
 
 class PriceFetcher(ABC):
 
@@ -70,11 +147,22 @@ class PriceParser(ABC):
 
 
 class Notifier(ABC):
+    """
+    on_delivered, quando informado, é chamado uma vez por envio bem-sucedido, com a
+    lista das mensagens que esse envio entregou (não é chamado se o envio falhar).
+    """
 
     @abstractmethod
-    def notify(self, message: str) -> None:
+    def notify(self, message: str, on_delivered: Optional[Callable[[List[str]], None]] = None) -> None:
         pass
 
+    def notify_batch(
+        self, messages: List[str], on_delivered: Optional[Callable[[List[str]], None]] = None
+    ) -> None:
+        # Implementação padrão: uma notificação por mensagem
+        for message in messages:
+            self.notify(message, on_delivered)
+
 
 # ==========================
 # Implementações concretas
@@ -88,8 +176,8 @@ class JsonFileConfigRepository(ConfigRepository):
         self._data = self._load_json()
 
     def _load_json(self) -> dict:
-        with open(self._path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(self._path, "rb") as f:
+            return orjson.loads(f.read())
 
     def load_products(self) -> List[Product]:
         products_raw = self._data.get("products", [])
@@ -107,8 +195,11 @@ class JsonFileConfigRepository(ConfigRepository):
     def get_webhook_url(self) -> str:
         return self._data["webhook_url"]
 
-    def get_interval_between_products(self) -> int:
-        return int(self._data.get("interval_between_products_seconds", 30))
+    def get_max_concurrent_fetches(self) -> int:
+        return int(self._data.get("max_concurrent_fetches", 8))
+
+    def get_max_requests_per_host(self) -> int:
+        return int(self._data.get("max_requests_per_host", 2))
 
     def get_interval_between_cycles(self) -> int:
         return int(self._data.get("interval_between_cycles_seconds", 3600))
@@ -116,99 +207,474 @@ class JsonFileConfigRepository(ConfigRepository):
     def get_max_retries_per_product(self) -> int:
         return int(self._data.get("max_retries_per_product", 2))
 
+    def get_http_client(self) -> str:
+        return self._data.get("http_client", "requests")
+
     def get_retry_delay_seconds(self) -> int:
         return int(self._data.get("retry_delay_seconds", 30))
 
+    def get_max_retry_delay_seconds(self) -> int:
+        return int(self._data.get("max_retry_delay_seconds", 300))
+
     def get_request_headers(self) -> Dict[str, str]:
         return self._data.get("request_headers", {})
 
+    def get_state_path(self) -> str:
+        return self._data.get("state_path", "state.json")
+
+    def get_parse_processes_threshold(self) -> int:
+        return int(self._data.get("parse_processes_threshold", 50))
+
+
+class JsonFileNotificationStateRepository(NotificationStateRepository):
+    """Guarda em um arquivo JSON o último preço notificado de cada produto (por URL)."""
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def load_last_notified(self) -> Dict[str, float]:
+        if not os.path.exists(self._path):
+            return {}
+        with open(self._path, "rb") as f:
+            data = orjson.loads(f.read())
+        return {url: float(price) for url, price in data.get("last_notified", {}).items()}
+
+    def save_last_notified(self, last_notified: Dict[str, float]) -> None:
+        # Escreve num temporário e troca, para não deixar o arquivo pela metade
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps({"last_notified": last_notified}, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, self._path)
+
 
 class RequestsPriceFetcher(PriceFetcher):
-    def __init__(self, headers=None, timeout=15, use_session=False):
-        self._headers = headers or {}
+    """
+    Busca o HTML dos produtos via requests.
+
+    Por padrão usa uma requests.Session com pool de conexões, reaproveitando
+    as conexões TCP/TLS abertas com o mesmo host entre um produto e outro.
+
+    Guarda ETag / Last-Modified de cada página e faz GETs condicionais: se o
+    servidor responder 304 Not Modified, devolve o HTML que já estava em cache.
+
+    Se receber um stop_pattern, lê a resposta em streaming e para de baixar
+    assim que o padrão aparece (ex.: o span do preço), devolvendo só o começo da página.
+    """
+
+    # Quanto do chunk anterior é mantido na busca, para não perder um match cortado ao meio
+    _STOP_OVERLAP = 1024
+
+    def __init__(self, headers=None, timeout=15, use_session=True, stop_pattern: Optional[Pattern[str]] = None):
+        self._headers = CaseInsensitiveDict(headers or {})
+        # O requests já pede gzip/deflate; isto só acrescenta br (ou zstd) quando o
+        # decodificador correspondente (brotli / zstandard) estiver instalado
+        self._headers.setdefault("Accept-Encoding", make_headers(accept_encoding=True)["accept-encoding"])
         self._timeout = timeout
+        self._stop_pattern = stop_pattern
         self._use_session = use_session
-        self._session = requests.Session() if use_session else None
+        self._session = self._build_session() if use_session else None
+
+        # url -> (etag, last_modified, html)
+        self._cache: Dict[str, Tuple[Optional[str], Optional[str], str]] = {}
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def _build_session() -> requests.Session:
+        session = requests.Session()
+        retry = Retry(
+            total=3,
+            backoff_factor=1,
+            # 429/503 ficam de fora: quem respeita o Retry-After e faz o backoff é o
+            # monitor, que consegue ser interrompido e não segura o slot do host esperando.
+            # Sem o respect_retry_after_header=False, o urllib3 ainda repetiria qualquer
+            # 429/503 com Retry-After, mesmo fora do status_forcelist.
+            status_forcelist=[500, 502, 504],
+            respect_retry_after_header=False,
+            # Esgotadas as tentativas, devolve a resposta para o raise_for_status
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def fetch_html(self, product: Product) -> str:
+        headers = CaseInsensitiveDict(self._headers)
+        with self._cache_lock:
+            cached = self._cache.get(product.url)
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
         if self._use_session and self._session:
-            resp = self._session.get(product.url, headers=self._headers, timeout=self._timeout)
+            resp = self._session.get(product.url, headers=headers, timeout=self._timeout, stream=True)
         else:
-            resp = requests.get(product.url, headers=self._headers, timeout=self._timeout)
+            resp = requests.get(product.url, headers=headers, timeout=self._timeout, stream=True)
+
+        try:
+            if resp.status_code == 304 and cached:
+                return cached[2]
+
+            resp.raise_for_status()
+            html = self._read_body(resp)
+        finally:
+            resp.close()
+
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if etag or last_modified:
+            with self._cache_lock:
+                self._cache[product.url] = (etag, last_modified, html)
+        return html
+
+    def _read_body(self, resp: requests.Response) -> str:
+        if self._stop_pattern is None:
+            return resp.text
+
+        if resp.encoding is None:
+            resp.encoding = "utf-8"
+
+        chunks: List[str] = []
+        tail = ""
+        for chunk in resp.iter_content(chunk_size=16384, decode_unicode=True):
+            chunks.append(chunk)
+            window = tail + chunk
+            if self._stop_pattern.search(window):
+                break  # já temos o que interessa, o resto da página é descartado
+            tail = window[-self._STOP_OVERLAP:]
+        return "".join(chunks)
+
+    def close(self) -> None:
+        if self._session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+
+
+class HttpxPriceFetcher(PriceFetcher):
+    """
+    Busca o HTML dos produtos via httpx.Client com HTTP/2.
 
+    Com HTTP/2 as requisições paralelas ao mesmo host são multiplexadas
+    numa única conexão TLS persistente, em vez de abrir uma conexão por thread.
+    """
+
+    def __init__(self, headers=None, timeout=15, max_connections=100, max_keepalive_connections=20):
+        if httpx is None:
+            raise RuntimeError("HttpxPriceFetcher requer o pacote httpx (pip install 'httpx[http2]').")
+
+        self._client = httpx.Client(
+            headers=headers or {},
+            timeout=timeout,
+            http2=True,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
+
+    def fetch_html(self, product: Product) -> str:
+        resp = self._client.get(product.url)
         resp.raise_for_status()
         return resp.text
 
+    def close(self) -> None:
+        self._client.close()
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
 
 class AmazonPriceParser(PriceParser):
     """
     Estratégia de parsing para páginas da Amazon.
 
-    1º tenta pegar o texto completo (R$ 1.499,99) em span.a-offscreen.
-    Se não encontrar, usa os spans a-price-whole + a-price-fraction.
+    1º tenta achar o span.a-offscreen (R$ 1.499,99) direto no HTML cru, via regex.
+    Se não achar, monta a árvore com lxml e busca, numa única consulta XPath,
+    o span.a-offscreen e os spans a-price-whole + a-price-fraction.
+
+    Os preços já extraídos ficam num cache (LRU) indexado pelo hash do HTML,
+    então páginas idênticas entre um ciclo e outro não são parseadas de novo.
     """
 
+    def __init__(self, cache_size: int = 32):
+        self._cache_size = cache_size
+        self._parse_cache: "OrderedDict[int, Optional[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
     def extract_price(self, html: str) -> Optional[float]:
-        soup = BeautifulSoup(html, "html.parser")
+        key = hash(html)
+        with self._cache_lock:
+            if key in self._parse_cache:
+                self._parse_cache.move_to_end(key)
+                return self._parse_cache[key]
+
+        price = self._extract_price_uncached(html)
+
+        with self._cache_lock:
+            self._parse_cache[key] = price
+            self._parse_cache.move_to_end(key)
+            while len(self._parse_cache) > self._cache_size:
+                self._parse_cache.popitem(last=False)
+        return price
+
+    def _extract_price_uncached(self, html: str) -> Optional[float]:
+        # ---------- ATALHO: regex sobre o HTML cru, sem montar a árvore ----------
+        match = _PRICE_RE.search(html)
+        if match:
+            price = self._parse_brazilian_currency(match.group(1))
+            if price is not None:
+                return price
+
+        return self._extract_price_from_dom(html)
+
+    @classmethod
+    def _extract_price_from_dom(cls, html: str) -> Optional[float]:
+        try:
+            doc = cls._parse_document(html)
+        except (etree.ParserError, ValueError):
+            print("[DEBUG] AmazonPriceParser: HTML vazio ou inválido.")
+            return None
 
-        # ---------- TENTATIVA 1: span.a-offscreen (funciona na maioria dos casos) ----------
-        price_span = soup.select_one("span.a-offscreen")
-        if not price_span:
-            price_span = soup.select_one("#corePrice_feature_div span.a-offscreen")
+        # Uma só varredura da árvore traz os candidatos; separa cada um pela classe
+        offscreen_text = whole_text = frac_text = None
+        for node in _PRICE_XPATH(doc):
+            classes = (node.get("class") or "").split()
+            text = node.text_content().strip()
+            if "a-offscreen" in classes:
+                offscreen_text = text
+            elif "a-price-whole" in classes:
+                whole_text = text
+            elif "a-price-fraction" in classes:
+                frac_text = text
 
-        if price_span and price_span.get_text(strip=True):
-            raw_price = price_span.get_text(strip=True)
-            return self._parse_brazilian_currency(raw_price)
+        # ---------- TENTATIVA 1: span.a-offscreen (funciona na maioria dos casos) ----------
+        if offscreen_text:
+            return cls._parse_brazilian_currency(offscreen_text)
 
         # ---------- TENTATIVA 2: a-price-whole + a-price-fraction (como no print) ----------
-        whole_el = soup.select_one("span.a-price-whole")
-        frac_el = soup.select_one("span.a-price-fraction")
-
-        if whole_el:
-            whole_text = whole_el.get_text(strip=True)
-            frac_text = frac_el.get_text(strip=True) if frac_el else "00"
+        if whole_text is not None:
+            frac_text = frac_text or "00"
 
             # monta algo tipo "R$ 1.499,99"
             composed_price = f"R$ {whole_text},{frac_text}"
-            return self._parse_brazilian_currency(composed_price)
+            return cls._parse_brazilian_currency(composed_price)
 
         # Se chegou até aqui, realmente não achou nada de preço
         print("[DEBUG] AmazonPriceParser: não encontrou nem a-offscreen nem a-price-whole.")
         return None
 
+    @staticmethod
+    def _parse_document(html: str):
+        try:
+            return lxml_html.fromstring(html)
+        except ValueError:
+            # O lxml recusa str que começa com declaração de encoding XML; como o texto
+            # já está decodificado, reparseia em bytes UTF-8 ignorando a declaração
+            parser = lxml_html.HTMLParser(encoding="utf-8")
+            return lxml_html.fromstring(html.encode("utf-8"), parser=parser)
+
     @staticmethod
     def _parse_brazilian_currency(text: str) -> Optional[float]:
         """
         Converte texto como 'R$ 1.234,56' em float 1234.56.
         """
-        import re
-
         # Mantém apenas dígitos, pontos e vírgulas
-        filtered = re.sub(r"[^\d,\.]", "", text)
+        filtered = _NON_NUMERIC_RE.sub("", text)
         if not filtered:
             return None
 
         # Remove separador de milhar (.) e troca vírgula por ponto
-        normalized = filtered.replace(".", "").replace(",", ".")
+        normalized = filtered.translate(_BRL_TO_FLOAT_TABLE)
         try:
             return float(normalized)
         except ValueError:
             return None
 
 
+def _init_parse_worker() -> None:
+    # Quem trata o Ctrl+C é o processo principal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _parse_dom_worker(html: str) -> Optional[float]:
+    return AmazonPriceParser._extract_price_from_dom(html)
+
+
+class ProcessPoolAmazonPriceParser(AmazonPriceParser):
+    """
+    AmazonPriceParser que manda só o fallback pela árvore (lxml) para um pool de processos.
+
+    O cache por hash e o atalho por regex continuam na thread que chamou, já que
+    resolvem quase todas as páginas sem custo; só as páginas que caem no parsing
+    completo (CPU-bound e preso ao GIL) pagam o envio do HTML para outro processo.
+
+    Os processos não são criados com fork: o pool sobe quando já há threads rodando
+    (busca, Discord), e um fork nesse estado pode herdar locks travados no filho.
+    Se um processo morrer, o pool é recriado em vez de falhar todo parsing seguinte.
+    """
+
+    def __init__(self, cache_size: int = 32, max_workers: Optional[int] = None):
+        super().__init__(cache_size=cache_size)
+        self._max_workers = max_workers or os.cpu_count()
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._mp_context = multiprocessing.get_context(start_method)
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self._max_workers,
+            mp_context=self._mp_context,
+            initializer=_init_parse_worker,
+        )
+
+    def _extract_price_from_dom(self, html: str) -> Optional[float]:
+        executor = self._executor
+        try:
+            return executor.submit(_parse_dom_worker, html).result()
+        except BrokenProcessPool:
+            self._restart_executor(executor)
+            return self._executor.submit(_parse_dom_worker, html).result()
+
+    def _restart_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._executor_lock:
+            # Outra thread pode ter recriado o pool enquanto esta esperava o lock
+            if self._executor is broken:
+                print("[WARN] Pool de parsing quebrou; recriando os processos...")
+                broken.shutdown(wait=False)
+                self._executor = self._new_executor()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+
 class DiscordWebhookNotifier(Notifier):
-    """Envia mensagem para um webhook do Discord."""
+    """
+    Envia mensagem para um webhook do Discord.
+
+    As mensagens entram numa fila e são enviadas por uma thread própria, para não
+    travar a verificação dos produtos. O envio respeita os headers de rate limit
+    do Discord (X-RateLimit-Remaining / X-RateLimit-Reset-After) e, se mesmo assim
+    receber 429, espera o Retry-After e tenta mais uma vez.
+
+    Os callbacks on_delivered rodam na thread de envio, só depois de um POST bem-sucedido.
+    """
+
+    # O limite do Discord é 2000 caracteres por mensagem; deixa uma folga
+    MAX_MESSAGE_LENGTH = 1900
 
     def __init__(self, webhook_url: str):
         self._webhook_url = webhook_url
+        # Sessão própria para reaproveitar a conexão TLS com o Discord entre envios
+        self._session = requests.Session()
+
+        # Estado do bucket de rate limit informado pelo Discord
+        self._remaining: Optional[int] = None
+        self._reset_at = 0.0
+
+        # Cada item: (conteúdo do POST, mensagens que ele carrega, callback de entrega)
+        self._queue: "queue.Queue[Optional[Tuple[str, List[str], Optional[Callable[[List[str]], None]]]]]" = (
+            queue.Queue()
+        )
+        self._worker = threading.Thread(target=self._run, name="discord-notifier", daemon=True)
+        self._worker.start()
+
+    def notify(self, message: str, on_delivered: Optional[Callable[[List[str]], None]] = None) -> None:
+        self._queue.put((message, [message], on_delivered))
+
+    def notify_batch(
+        self, messages: List[str], on_delivered: Optional[Callable[[List[str]], None]] = None
+    ) -> None:
+        """Junta as mensagens no menor número possível de POSTs, respeitando o limite de tamanho."""
+        chunk = ""
+        chunk_messages: List[str] = []
+        for message in messages:
+            candidate = f"{chunk}\n\n{message}" if chunk else message
+            if chunk and len(candidate) > self.MAX_MESSAGE_LENGTH:
+                self._queue.put((chunk, chunk_messages, on_delivered))
+                chunk, chunk_messages = message, [message]
+            else:
+                chunk = candidate
+                chunk_messages.append(message)
+        if chunk:
+            self._queue.put((chunk, chunk_messages, on_delivered))
+
+    def close(self) -> None:
+        """Envia o que ainda estiver na fila e encerra a thread de envio."""
+        self._queue.put(None)
+        self._worker.join()
+        self._session.close()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            content, messages, on_delivered = item
+            try:
+                self._send(content)
+            except Exception as e:
+                print(f"[ERROR] Falha ao enviar notificação para o Discord: {e}")
+                continue
+
+            if on_delivered:
+                try:
+                    on_delivered(messages)
+                except Exception as e:
+                    print(f"[ERROR] Falha ao registrar notificação entregue: {e}")
+
+    def _send(self, message: str) -> None:
+        payload = orjson.dumps({"content": message})
+
+        self._wait_for_bucket()
+        resp = self._post(payload)
+        self._update_bucket(resp)
+
+        if resp.status_code == 429:
+            retry_after = float(resp.headers.get("Retry-After", 1))
+            print(f"[WARN] Discord limitou o webhook, tentando de novo em {retry_after:.2f}s...")
+            time.sleep(retry_after)
+            resp = self._post(payload)
+            self._update_bucket(resp)
 
-    def notify(self, message: str) -> None:
-        payload = {"content": message}
-        resp = requests.post(self._webhook_url, json=payload, timeout=10)
         resp.raise_for_status()
 
+    def _post(self, payload: bytes) -> requests.Response:
+        return self._session.post(
+            self._webhook_url,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=10,
+        )
+
+    def _wait_for_bucket(self) -> None:
+        # Se o bucket esgotou, espera o reset em vez de mandar uma requisição fadada ao 429
+        now = time.monotonic()
+        if self._remaining is not None and self._remaining <= 0 and now < self._reset_at:
+            time.sleep(self._reset_at - now)
+
+    def _update_bucket(self, resp: requests.Response) -> None:
+        remaining = resp.headers.get("X-RateLimit-Remaining")
+        reset_after = resp.headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            self._remaining = int(remaining)
+        if reset_after is not None:
+            self._reset_at = time.monotonic() + float(reset_after)
+
 
 # ==========================
 # Orquestrador (Monitor)
@@ -221,93 +687,248 @@ class PriceMonitor:
         fetcher: PriceFetcher,
         parser: PriceParser,
         notifier: Notifier,
-        interval_between_products: int,
         interval_between_cycles: int,
         max_retries_per_product: int,
         retry_delay_seconds: int,
+        max_retry_delay_seconds: int = 300,
+        max_concurrent_fetches: int = 8,
+        max_requests_per_host: int = 2,
+        state_repository: Optional[NotificationStateRepository] = None,
     ):
         self._products = products
         self._fetcher = fetcher
         self._parser = parser
         self._notifier = notifier
-        self._interval_between_products = interval_between_products
+        self._state_repository = state_repository
         self._interval_between_cycles = interval_between_cycles
         self._max_retries_per_product = max_retries_per_product
         self._retry_delay_seconds = retry_delay_seconds
+        self._max_retry_delay_seconds = max_retry_delay_seconds
+        self._max_concurrent_fetches = max(1, max_concurrent_fetches)
+
+        # Limite de requisições simultâneas por host, para não martelar o site
+        hosts = {urlparse(p.url).hostname for p in products}
+        self._host_slots = {
+            host: threading.Semaphore(max(1, max_requests_per_host)) for host in hosts
+        }
+        self._print_lock = threading.Lock()
+
+        # Preços alvo num vetor alinhado com self._products, para comparar todos de uma vez
+        self._target_prices = np.asarray([p.target_price for p in products], dtype=np.float64)
+
+        # url -> último preço que gerou alerta; só notifica de novo se cair ainda mais.
+        # Só é atualizado depois que o notifier confirma a entrega (thread do notifier),
+        # por isso o lock.
+        self._last_notified: Dict[str, float] = (
+            state_repository.load_last_notified() if state_repository else {}
+        )
+        self._state_lock = threading.Lock()
+
+        # Sinaliza o encerramento; as esperas usam wait() para acordar na hora
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _warm_up_dns(self) -> None:
+        """Resolve uma vez cada host dos produtos, antes do primeiro ciclo."""
+        endpoints = set()
+        for product in self._products:
+            parsed = urlparse(product.url)
+            try:
+                port = parsed.port
+            except ValueError as e:
+                # URL com porta inválida: o erro aparece na busca desse produto, não aqui
+                self._log(f"[WARN] URL inválida em '{product.name}': {e}")
+                continue
+            if parsed.hostname:
+                endpoints.add((parsed.hostname, port or (80 if parsed.scheme == "http" else 443)))
+
+        for host, port in endpoints:
+            try:
+                socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            except OSError as e:
+                self._log(f"[WARN] Não foi possível resolver {host}: {e}")
+
+    def _log(self, message: str) -> None:
+        # Evita que as mensagens das threads saiam misturadas no terminal
+        with self._print_lock:
+            print(message)
+
+    def _backoff_delay(self, attempts: int) -> float:
+        # Backoff exponencial com "full jitter": sorteia entre 0 e base * 2^(n-1), limitado ao teto
+        ceiling = min(self._max_retry_delay_seconds, self._retry_delay_seconds * 2 ** (attempts - 1))
+        return max(1.0, ceiling * random.random())
 
-    def _random_retry_delay(self):
-        import random
-        base = self._retry_delay_seconds
-        delay = base + random.uniform(-2, 5)
-        return max(1, delay)
+    @staticmethod
+    def _retry_after_seconds(error: Exception) -> Optional[float]:
+        """Lê o Retry-After de um erro HTTP 429/503, em segundos (None se não houver)."""
+        response = getattr(error, "response", None)
+        if response is None or response.status_code not in (429, 503):
+            return None
+
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            # Retry-After também pode vir como data HTTP
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
 
-    def _check_single_product(self, product: Product) -> None:
+    def _check_single_product(self, product: Product) -> Optional[float]:
         attempts = 0
         last_html = None
 
         while attempts <= self._max_retries_per_product:
+            # Encerrando: produtos que ainda estavam na fila nem chegam a ser buscados
+            if self._stop_event.is_set():
+                return None
+
             attempts += 1
+            retry_after = None
             try:
-                html = self._fetcher.fetch_html(product)
+                with self._host_slots[urlparse(product.url).hostname]:
+                    if self._stop_event.is_set():
+                        return None
+                    html = self._fetcher.fetch_html(product)
                 last_html = html
                 current_price = self._parser.extract_price(html)
 
                 if current_price is not None:
-                    print(
+                    self._log(
                         f"[INFO] {product.name} -> preço atual R$ {current_price:.2f} "
                         f"(target R$ {product.target_price:.2f})"
                     )
+                    return current_price  # sucesso, sai do while
 
-                    if current_price <= product.target_price:
-                        msg = (
-                            f"🔥 O preço do produto **{product.name}** caiu para "
-                            f"**R$ {current_price:.2f}** (alvo: R$ {product.target_price:.2f})\n"
-                            f"Link: {product.url}"
-                        )
-                        self._notifier.notify(msg)
-
-                    return  # sucesso, sai do while
-
-                print(
+                self._log(
                     f"[WARN] Tentativa {attempts} não conseguiu extrair o preço de '{product.name}'."
                 )
 
             except Exception as e:
-                print(f"[ERROR] Erro na tentativa {attempts} para {product.name}: {e}")
+                self._log(f"[ERROR] Erro na tentativa {attempts} para {product.name}: {e}")
+                retry_after = self._retry_after_seconds(e)
 
             if attempts <= self._max_retries_per_product:
-                delay = self._random_retry_delay()
-                print(f"Aguardando {delay:.2f} segundos para tentar novamente...")
-                time.sleep(delay)
+                # Se o servidor disse quanto esperar, obedece; senão, backoff exponencial
+                delay = retry_after if retry_after is not None else self._backoff_delay(attempts)
+                self._log(
+                    f"[{product.name}] Aguardando {delay:.2f} segundos para tentar novamente..."
+                )
+                if self._stop_event.wait(delay):
+                    return None
 
         # se chegou aqui, falhou todas as tentativas
-        print(f"[ERROR] Falha definitiva ao extrair preço de '{product.name}'.")
+        self._log(f"[ERROR] Falha definitiva ao extrair preço de '{product.name}'.")
         if last_html:
-            with open("last_failed.html", "w", encoding="utf-8") as f:
-                f.write(last_html)
-            print("[DEBUG] HTML da última tentativa salvo em last_failed.html")
+            with self._print_lock:
+                with open("last_failed.html", "w", encoding="utf-8") as f:
+                    f.write(last_html)
+                print("[DEBUG] HTML da última tentativa salvo em last_failed.html")
+        return None
 
     def check_once(self) -> None:
-        for idx, product in enumerate(self._products, start=1):
-            print(f"\n--- Produto {idx}: {product.name} ---")
-            self._check_single_product(product)
-
-            if idx < len(self._products):
-                print(
-                    f"Aguardando {self._interval_between_products} segundos "
-                    f"antes de verificar o próximo produto..."
-                )
-                time.sleep(self._interval_between_products)
+        if not self._products:
+            return
+
+        max_workers = min(len(self._products), self._max_concurrent_fetches)
+        self._log(f"Verificando {len(self._products)} produto(s) com até {max_workers} em paralelo...")
+
+        # NaN para quem falhou: NaN <= alvo é sempre falso, então não dispara alerta
+        current_prices = np.full(len(self._products), np.nan, dtype=np.float64)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._check_single_product, product): idx
+                for idx, product in enumerate(self._products)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    price = future.result()
+                except Exception as e:
+                    self._log(f"[ERROR] Erro inesperado ao verificar {self._products[idx].name}: {e}")
+                    continue
+                if price is not None:
+                    current_prices[idx] = price
+
+        # Compara todos os preços com os alvos numa única operação vetorizada
+        hits = np.nonzero(current_prices <= self._target_prices)[0]
+        above = np.nonzero(current_prices > self._target_prices)[0]
+
+        # mensagem -> (url, preço), para registrar o estado quando a entrega for confirmada
+        alerts: Dict[str, Tuple[str, float]] = {}
+        with self._state_lock:
+            for i in hits:
+                product = self._products[i]
+                price = float(current_prices[i])
+                if price < self._last_notified.get(product.url, float("inf")):
+                    alerts[self._build_alert(product, price)] = (product.url, price)
+
+            # Voltou para cima do alvo: esquece o último alerta, para avisar de novo quando cair
+            state_changed = False
+            for i in above:
+                if self._last_notified.pop(self._products[i].url, None) is not None:
+                    state_changed = True
+            if state_changed:
+                self._save_state()
+
+        if alerts:
+            self._log(f"Enviando {len(alerts)} alerta(s) de preço...")
+            self._notifier.notify_batch(
+                list(alerts),
+                on_delivered=lambda messages: self._record_notified([alerts[m] for m in messages]),
+            )
+
+    def _record_notified(self, delivered: List[Tuple[str, float]]) -> None:
+        # Registra tudo o que um envio entregou e grava o estado uma vez só
+        with self._state_lock:
+            state_changed = False
+            for url, price in delivered:
+                if price < self._last_notified.get(url, float("inf")):
+                    self._last_notified[url] = price
+                    state_changed = True
+            if state_changed:
+                self._save_state()
+
+    def _save_state(self) -> None:
+        # Chamado com self._state_lock já adquirido
+        if self._state_repository:
+            self._state_repository.save_last_notified(self._last_notified)
+
+    @staticmethod
+    def _build_alert(product: Product, current_price: float) -> str:
+        return (
+            f"🔥 O preço do produto **{product.name}** caiu para "
+            f"**R$ {current_price:.2f}** (alvo: R$ {product.target_price:.2f})\n"
+            f"Link: {product.url}"
+        )
 
     def run_forever(self) -> None:
-        while True:
+        self._warm_up_dns()
+
+        while not self._stop_event.is_set():
+            # Agenda pelo início do ciclo (taxa fixa), para a duração do ciclo não acumular atraso
+            next_cycle_at = time.monotonic() + self._interval_between_cycles
+
             print("\n=========== INICIANDO CICLO DE VERIFICAÇÃO ===========")
             self.check_once()
+
+            wait = max(0.0, next_cycle_at - time.monotonic())
             print(
-                f"\nCiclo finalizado. Aguardando {self._interval_between_cycles} segundos "
+                f"\nCiclo finalizado. Aguardando {wait:.0f} segundos "
                 f"para iniciar um novo ciclo...\n"
             )
-            time.sleep(self._interval_between_cycles)
+            if self._stop_event.wait(wait):
+                break
+
+        print("Monitor encerrado.")
 
 
 
@@ -323,27 +944,55 @@ def main():
     webhook_url = config.get_webhook_url()
     headers = config.get_request_headers()
 
-    interval_between_products = config.get_interval_between_products()
+    max_concurrent_fetches = config.get_max_concurrent_fetches()
+    max_requests_per_host = config.get_max_requests_per_host()
     interval_between_cycles = config.get_interval_between_cycles()
     max_retries = config.get_max_retries_per_product()
     retry_delay = config.get_retry_delay_seconds()
-
-    fetcher = RequestsPriceFetcher(headers=headers)
-    parser = AmazonPriceParser()   # sua versão original
+    max_retry_delay = config.get_max_retry_delay_seconds()
+
+    if config.get_http_client() == "httpx":
+        fetcher = HttpxPriceFetcher(headers=headers)
+    else:
+        fetcher = RequestsPriceFetcher(headers=headers, stop_pattern=_PRICE_RE)
+    if len(products) >= config.get_parse_processes_threshold():
+        # Muitos produtos: o parsing pela árvore vai para um pool de processos
+        parser = ProcessPoolAmazonPriceParser()
+    else:
+        parser = AmazonPriceParser()   # sua versão original
     notifier = DiscordWebhookNotifier(webhook_url)
+    state_repository = JsonFileNotificationStateRepository(config.get_state_path())
 
     monitor = PriceMonitor(
         products=products,
         fetcher=fetcher,
         parser=parser,
         notifier=notifier,
-        interval_between_products=interval_between_products,
         interval_between_cycles=interval_between_cycles,
         max_retries_per_product=max_retries,
         retry_delay_seconds=retry_delay,
+        max_retry_delay_seconds=max_retry_delay,
+        max_concurrent_fetches=max_concurrent_fetches,
+        max_requests_per_host=max_requests_per_host,
+        state_repository=state_repository,
     )
 
-    monitor.run_forever()
+    def request_stop(signum, frame):
+        monitor.stop()
+        # Um segundo Ctrl+C interrompe na hora, sem esperar as buscas em andamento
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    # Ctrl+C / kill encerram o monitor sem esperar o fim do intervalo nem a fila do ciclo
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    try:
+        monitor.run_forever()
+    finally:
+        fetcher.close()
+        notifier.close()
+        if isinstance(parser, ProcessPoolAmazonPriceParser):
+            parser.close()
 
 
 